@@ -1,52 +1,53 @@
 """End user methods
 """
 
-import heapq
 import random
 
+import numpy as np
 import spacy
 
-from statistics import mean
-
 from phrase_tools import best_phrases
 from regex_tools import clean_message, remove_unnecessary_words
 from vocab_tools import get_telegram_data
-from nlp_tools import get_keyphrases, lex_match_score
+from nlp_tools import get_keyphrases, lex_match_score, PhraseVectorTable, similarity_matrix, token_columns
 
 
 def get_model_keyphrase_data():
-    '''Loads and returns spacy model, keyphrases and their model embeddings.
+    '''Loads and returns the phrase vector table of the spacy model, keyphrases,
+    their model embeddings and the columns of their tokens.
     '''
     crypto_model = spacy.load('./models/spacy.crypto.word2vec.model')
     stopwords = spacy.load('en_core_web_sm').Defaults.stop_words
     keyphrase_data = get_keyphrases()
-    return crypto_model, keyphrase_data, [crypto_model(str(kp)) for kp in keyphrase_data], stopwords
+    phrase_table = PhraseVectorTable(crypto_model)
+    keyphrase_tokens = [phrase_table.tokenize(str(kp)) for kp in keyphrase_data]
+    return phrase_table, keyphrase_data, phrase_table.token_vectors(keyphrase_tokens),\
+        token_columns(keyphrase_tokens), stopwords
 
 
 def get_keyphrase_matches(messages):
     '''Main end-user method to extract keywords given a list of messages
     '''
-    crypto_model, keyphrase_data, model_embedded_keyphrases, stopwords = get_model_keyphrase_data()
+    phrase_table, keyphrase_data, model_embedded_keyphrases, keyphrase_columns, stopwords =\
+        get_model_keyphrase_data()
 
     num_best_matches = 10
     keyphrase_matches = []
     for i, best_cleaned_phrases in enumerate(best_phrases(messages)):
         # Get the best noun-phrases
         crypto_phrases = []
-        for phrase in best_cleaned_phrases:
-            crypto_match_scores = []
-            for kp in model_embedded_keyphrases:
-                semantic_score = crypto_model(phrase.lower()).similarity(kp)
-                # If there are less than num_best_matches keep pushing onto the heap
-                if len(crypto_match_scores) < num_best_matches:
-                    heapq.heappush(crypto_match_scores, semantic_score)
-                # If heap is full and semantic score beats lowest score, pop lowest and push score onto heap
-                elif semantic_score > heapq.nlargest(num_best_matches, crypto_match_scores)[-1]:
-                    heapq.heappop(crypto_match_scores)
-                    heapq.heappush(crypto_match_scores, semantic_score)
-
+        phrase_tokens = [phrase_table.tokenize(phrase.lower())
+                         for phrase in best_cleaned_phrases]
+        semantic_scores = similarity_matrix(
+            phrase_tokens, phrase_table.token_vectors(phrase_tokens),
+            model_embedded_keyphrases, keyphrase_columns)
+        # Keep the num_best_matches highest scores against the vocabulary
+        if semantic_scores.shape[1] > num_best_matches:
+            semantic_scores = np.partition(
+                semantic_scores, -num_best_matches, axis=1)[:, -num_best_matches:]
+        for phrase, crypto_match_scores in zip(best_cleaned_phrases, semantic_scores):
             # Compute mean semantic score and lexical match score
-            semantic_net_score = mean(heapq.nlargest(10, crypto_match_scores))
+            semantic_net_score = float(crypto_match_scores.mean())
             lms = lex_match_score(keyphrase_data, phrase)
 
             # Empirically determined constants
@@ -3,6 +3,8 @@
 
 import pickle
 
+from itertools import groupby
+
 import numpy as np
 import pandas as pd
 
@@ -48,6 +50,109 @@ def keyphrase_extractor():
     return extractor
 
 
+class PhraseVectorTable:
+    '''Averages word vectors of short phrases straight from the vectors table
+    of a SpaCy model, without building a Doc for every phrase.
+
+    Phrases are split with the model's own tokenizer, so vectors(phrases)[i]
+    is equal to model(phrases[i]).vector
+    '''
+
+    def __init__(self, model):
+        vectors = model.vocab.vectors
+        strings = model.vocab.strings
+        # Token text -> row in the vectors table, built from vocab/key2row.
+        # Tokens without a vector point at the trailing zero row, same as
+        # Token.vector returning zeros for them.
+        self.token_rows = {}
+        for text in strings:
+            row = vectors.key2row.get(strings[text], -1)
+            if row >= 0:
+                self.token_rows[text] = row
+        self.table = np.vstack(
+            [np.asarray(vectors.data, dtype='float32'),
+             np.zeros((1, vectors.shape[1]), dtype='float32')])
+        self.oov_row = self.table.shape[0] - 1
+
+        # The model has no pipeline components, so its tokenizer alone gives
+        # the tokens of model(phrase)
+        self.tokenizer = model.tokenizer
+        # Whitespace delimited span -> token texts, like the tokenizer cache
+        self.cache = {}
+
+    def tokenize(self, phrase):
+        '''Token texts of a phrase, same as [token.text for token in model(phrase)].
+        The tokenizer splits every whitespace delimited span on its own, so it
+        only runs once per distinct span.
+        '''
+        tokens = []
+        at_start = True
+        for is_space, chars in groupby(phrase, str.isspace):
+            span = ''.join(chars)
+            if is_space:
+                # A single space after a token is its trailing whitespace,
+                # anything else becomes a whitespace token
+                if not at_start and span[0] == ' ':
+                    span = span[1:]
+                if span:
+                    tokens.append(span)
+            else:
+                if span not in self.cache:
+                    self.cache[span] = [token.text for token in self.tokenizer(span)]
+                tokens.extend(self.cache[span])
+            at_start = False
+        return tokens
+
+    def vectors(self, phrases):
+        '''Return a (len(phrases), width) array of phrase vectors
+        '''
+        return self.token_vectors([self.tokenize(phrase) for phrase in phrases])
+
+    def token_vectors(self, token_lists):
+        '''Same as vectors, for phrases already split with tokenize
+        '''
+        rows = []
+        owners = []
+        lengths = np.zeros(len(token_lists), dtype='float32')
+        for i, tokens in enumerate(token_lists):
+            lengths[i] = len(tokens)
+            rows.extend(self.token_rows.get(token, self.oov_row)
+                        for token in tokens)
+            owners.extend([i] * len(tokens))
+
+        sums = np.zeros((len(token_lists), self.table.shape[1]), dtype='float32')
+        np.add.at(sums, np.asarray(owners, dtype='int64'),
+                  self.table[np.asarray(rows, dtype='int64')])
+        # Empty phrases stay as zero vectors like an empty Doc
+        return sums / np.maximum(lengths, 1)[:, None]
+
+
+def token_columns(token_lists):
+    '''Map the tokens of every phrase to the columns(indices) it occupies
+    '''
+    columns = {}
+    for i, tokens in enumerate(token_lists):
+        columns.setdefault(tuple(tokens), []).append(i)
+    return columns
+
+
+def similarity_matrix(phrase_tokens, phrase_vectors, other_vectors, other_columns):
+    '''Doc.similarity of every phrase against every other phrase.
+    Like Doc.similarity, phrases with the same tokens score 1 even without
+    vectors, otherwise a zero vector scores 0 and the rest get cosine similarity.
+
+    other_columns is token_columns of the other phrases.
+    '''
+    phrase_norms = np.linalg.norm(phrase_vectors, axis=1)
+    other_norms = np.linalg.norm(other_vectors, axis=1)
+    norms = np.outer(phrase_norms, other_norms)
+    scores = phrase_vectors @ other_vectors.T
+    scores = np.divide(scores, norms, out=np.zeros_like(scores), where=norms != 0)
+    for i, tokens in enumerate(phrase_tokens):
+        scores[i, other_columns.get(tuple(tokens), [])] = 1.0
+    return scores
+
+
 def lex_match_score(data, phrase):
     '''Returns lexicographical matching score of a phrase
     with respect to a vocabulary
@@ -21,24 +21,28 @@ def get_abbs_terms():
     return abbs, terms
 
 
-def get_messari_news():
-    '''Use Messari API to get all news articles per page.
-    Scrape the webpage content to get main article text
+def iter_messari_news(page=1):
+    '''Use Messari API to get news articles page by page, starting at page.
+    Yields the page number along with the main article text of its articles
     '''
     messari = Messari('4a9b688a-59af-45e3-ac6c-7ae9b046dd83')
 
-    messari_res = []
-    page = 1
     while True:
         res = messari.get_all_news(page)
         # if 'data' not in res:
         if 'data' not in res or page == 50:
             break
-        messari_res.extend([clean_scraped_text(article['content'])
-                           for article in res['data']])
+        yield page, [clean_scraped_text(article['content'])
+                     for article in res['data']]
         page += 1
         print("Messari IO: Got data from page "+str(page))
-    return messari_res
+
+
+def get_messari_news():
+    '''Use Messari API to get all news articles per page.
+    Scrape the webpage content to get main article text
+    '''
+    return [article for _, articles in iter_messari_news() for article in articles]
 
 
 def text_from_html(response, source):
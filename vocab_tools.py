@@ -1,10 +1,17 @@
 """Use methods in scrape_tools to load data into the KeyphraseExtractor
 and generate dataset of crypto related keyphrase/words.
 """
+import multiprocessing
+import os
 import pickle
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pandas as pd
 
-from scrape_tools import get_data, get_messari_news, clean_article, get_abbs_terms
+from scrape_tools import get_data, get_messari_news, iter_messari_news, clean_article, get_abbs_terms
 from nlp_tools import keyphrase_extractor
 
 
@@ -140,3 +147,210 @@ def augment_vocabulary():
 
     with open('./datasets/keyphrases.pkl', 'wb') as file:
         pickle.dump(keyphrases, file)
+
+
+# Articles are concatenated into batches before keyphrase extraction,
+# same batch sizes as get_keyphrases
+SOURCE_BATCH_SIZES = {'thetie': 5, 'block': 5, 'messari': 10}
+SOURCE_NAMES = {'thetie': 'TheTie', 'block': 'The Block', 'messari': 'Messari IO'}
+CHECKPOINT_DIR = './datasets/checkpoints'
+
+# Extractor of the current worker process, see init_extractor_worker
+worker_extractor = None
+
+
+def save_pickle_atomic(data, path):
+    '''Pickle data to a temporary file and move it over path, so that
+    an interruption never leaves a half-written file behind
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def checkpoint_path(source):
+    '''Path of the checkpoint file of a source
+    '''
+    return os.path.join(CHECKPOINT_DIR, source + '.pkl')
+
+
+def load_checkpoint(source):
+    '''Load the progress of a source from an earlier run. Holds the leaf sites
+    or the last Messari IO page, the number of articles fetched, the texts of articles whose batch is not
+    extracted yet and the keyphrases of every extracted batch.
+    '''
+    path = checkpoint_path(source)
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    return {'sites': None, 'page': 0, 'fetched': 0, 'complete': False,
+            'articles': {}, 'keyphrases': {}}
+
+
+def report_progress(source, stage, done, total, start_time, start_count):
+    '''Print progress of a source along with items/second for this run.
+    total is None while it is not known yet.
+    '''
+    elapsed = time.time() - start_time
+    rate = (done - start_count) / elapsed if elapsed > 0 else 0
+    print("{}: {} {}/{} ({:.2f} items/s)".format(
+        SOURCE_NAMES[source], stage, done, '?' if total is None else total, rate))
+
+
+def init_extractor_worker():
+    '''Load the keyphrase extractor once per worker process
+    '''
+    global worker_extractor
+    worker_extractor = keyphrase_extractor()
+
+
+def extract_batch(text):
+    '''Run in a worker process: extract and filter keyphrases of a batch of articles
+    '''
+    return [str(phrase) for phrase in filter_phrases(worker_extractor(text))]
+
+
+def fetch_new_articles(source, checkpoint, path):
+    '''Yield lists of article texts of a source which were not fetched
+    in an earlier run. Messari IO is fetched one news page at a time.
+    '''
+    if source == 'messari':
+        for page, articles in iter_messari_news(checkpoint['page'] + 1):
+            # Saved by the caller along with the articles of the page
+            checkpoint['page'] = page
+            yield articles
+    else:
+        if checkpoint['sites'] is None:
+            checkpoint['sites'] = get_leaf_sites(source)
+            save_pickle_atomic(checkpoint, path)
+        for site in checkpoint['sites'][checkpoint['fetched']:]:
+            yield [get_data(site, 'text', source)]
+
+
+def get_keyphrases_checkpointed(source, pool, stop):
+    '''Checkpointed version of get_keyphrases. Articles are fetched in this
+    thread while batches of them are extracted on the worker pool. Progress is
+    saved after every fetch and extracted batch, and picked up again on the
+    next call. Article texts are dropped once their batch is extracted.
+
+    Once the stop event is set, returns None after the current fetch.
+    '''
+    path = checkpoint_path(source)
+    checkpoint = load_checkpoint(source)
+    batch_size = SOURCE_BATCH_SIZES[source]
+    articles = checkpoint['articles']
+    done_batches = checkpoint['keyphrases']
+    pending = {}
+
+    def batch_indices(batch):
+        return range(batch * batch_size, min((batch + 1) * batch_size, checkpoint['fetched']))
+
+    def collect_batches(wait=False):
+        for batch, future in list(pending.items()):
+            if future.cancelled():
+                # Dropped by an interrupt, extracted again on the next run
+                del pending[batch]
+            elif wait or future.done():
+                done_batches[batch] = future.result()
+                del pending[batch]
+                for index in batch_indices(batch):
+                    del articles[index]
+                save_pickle_atomic(checkpoint, path)
+                num_batches = -(-checkpoint['fetched'] // batch_size)\
+                    if checkpoint['complete'] else None
+                report_progress(source, 'extracted batch', len(done_batches),
+                                num_batches, start_time, start_batches)
+
+    def submit_batches():
+        # Submit every batch whose articles have all been fetched
+        for batch in sorted(set(index // batch_size for index in articles)):
+            indices = batch_indices(batch)
+            is_complete = len(indices) == batch_size or checkpoint['complete']
+            if is_complete and batch not in done_batches and batch not in pending:
+                pending[batch] = pool.submit(
+                    extract_batch, ' '.join(articles[index] for index in indices))
+
+    start_time = time.time()
+    start_articles = checkpoint['fetched']
+    start_batches = len(done_batches)
+    if not checkpoint['complete']:
+        submit_batches()
+        for new_articles in fetch_new_articles(source, checkpoint, path):
+            for article in new_articles:
+                articles[checkpoint['fetched']] = article
+                checkpoint['fetched'] += 1
+            save_pickle_atomic(checkpoint, path)
+            num_articles = len(checkpoint['sites']) if checkpoint['sites'] is not None else None
+            report_progress(source, 'fetched article', checkpoint['fetched'],
+                            num_articles, start_time, start_articles)
+            if stop.is_set():
+                break
+            submit_batches()
+            collect_batches()
+        else:
+            checkpoint['complete'] = True
+            save_pickle_atomic(checkpoint, path)
+    if stop.is_set():
+        collect_batches()
+        return None
+    submit_batches()
+    collect_batches(wait=True)
+
+    return list(set(phrase for phrases in done_batches.values() for phrase in phrases))
+
+
+def augment_vocabulary_parallel(extract_workers=2):
+    '''Parallel and resumable version of augment_vocabulary.
+
+    TheTie, The Block and Messari IO are scraped concurrently and keyphrases
+    are extracted on a pool of extract_workers processes. Progress of every
+    source is checkpointed under CHECKPOINT_DIR, so rerunning after a failure
+    resumes from where it stopped. keyphrases.pkl is replaced atomically
+    once all sources are done, after which the checkpoints are removed.
+    '''
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    keyphrases = []
+
+    abbs, terms = get_abbs_terms()
+    keyphrases.extend(abbs)
+    keyphrases.extend(terms)
+
+    sources = list(SOURCE_BATCH_SIZES)
+    stop = threading.Event()
+    # Workers are started while the source threads are mid-request, so they
+    # are spawned rather than forked from this multi-threaded process
+    with ProcessPoolExecutor(max_workers=extract_workers, initializer=init_extractor_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as pool,\
+            ThreadPoolExecutor(max_workers=len(sources)) as source_pool:
+        futures = {source: source_pool.submit(get_keyphrases_checkpointed, source, pool, stop)
+                   for source in sources}
+        # Let every source finish or fail on its own so its checkpoint is
+        # as far along as possible, then report all failures
+        errors = []
+        try:
+            for source, future in futures.items():
+                error = future.exception()
+                if error is None:
+                    keyphrases.extend(future.result())
+                    print(SOURCE_NAMES[source] + ": Got keyphrases")
+                else:
+                    print(SOURCE_NAMES[source] + ": Failed with " + repr(error))
+                    errors.append(error)
+        except KeyboardInterrupt:
+            # Source threads stop after their current fetch with their progress
+            # saved, and batches not yet being extracted are dropped
+            print("Interrupted: saving checkpoints")
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        if errors:
+            raise errors[0]
+
+    keyphrases = list(set(keyphrases))
+    save_pickle_atomic(keyphrases, './datasets/keyphrases.pkl')
+
+    for source in sources:
+        os.remove(checkpoint_path(source))
+
+    return keyphrases